@@ -4,16 +4,57 @@ Allows humans to chat with the sales bot and download conversation logs.
 """
 
 import streamlit as st
-import json
+import orjson
+from collections import deque
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Any, Dict, Optional
+from uuid import uuid4
 import os
-from openai import OpenAI
+from io import BytesIO
 
-from models import ConversationOutcome, SimulationConfig, Intent, OutcomeChoices, IntentDetection, salesResponse
+try:
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    from reportlab.lib import colors
+    REPORTLAB = True
+except ImportError:
+    REPORTLAB = False
 
-from simulator import create_sales_prompt, call_llm,assess_conversation_status, initialize_client
+from models import SimulationConfig, INTENT_DISPLAY, OUTCOME_DISPLAY
 
+from simulator import (
+    SALES_SYSTEM_PROMPT,
+    assess_conversation_status,
+    summarize_history,
+    quick_classify,
+    get_client,
+    SalesReplyStream,
+)
+
+
+# Sales bot opening message, sent as-is at the start of every conversation
+SALES_OPENING = """Hi! Thanks for reaching out about our boxing fitness gym. I have a few questions to help us learn more about you:
+
+1. What's your main fitness goal? (weight loss, stress relief, learn technique, general fitness, etc.)
+2. How often do you currently exercise?
+3. Any concerns about high-intensity training?
+
+Looking forward to getting you started!"""
+
+# Sales history that follows the system prompt when a conversation starts
+INITIAL_HISTORY_TEMPLATE = ({"role": "assistant", "content": SALES_OPENING},)
+
+# Number of most recent chat messages rendered inline; older ones sit in an expander
+CHAT_WINDOW = 20
+
+# Exchanges always sent to the sales bot verbatim; older ones are folded into
+# a rolling summary once this many more have built up
+HISTORY_KEEP_TURNS = 4
+
+# Most recent sales-history messages the assessor gets to see
+ASSESSMENT_WINDOW = 6
 
 
 # Page configuration
@@ -68,10 +109,21 @@ st.markdown("""
 
 def initialize_session_state():
     """Initialize session state variables."""
-    if 'messages' not in st.session_state:
-        st.session_state.messages = []
+    if 'message_roles' not in st.session_state:
+        # Transcript kept as parallel lists; see add_message()
+        st.session_state.message_roles = []
+        st.session_state.message_contents = []
+        st.session_state.message_timestamps = []
+    if 'user_turn_count' not in st.session_state:
+        st.session_state.user_turn_count = 0
+    if 'sales_turn_count' not in st.session_state:
+        st.session_state.sales_turn_count = 0
     if 'sales_history' not in st.session_state:
         st.session_state.sales_history = []
+    if 'recent_window' not in st.session_state:
+        st.session_state.recent_window = deque(maxlen=ASSESSMENT_WINDOW)
+    if 'history_summary' not in st.session_state:
+        st.session_state.history_summary = None
     if 'conversation_started' not in st.session_state:
         st.session_state.conversation_started = False
     if 'conversation_ended' not in st.session_state:
@@ -80,6 +132,10 @@ def initialize_session_state():
         st.session_state.intent_detection = None
     if 'conversation_outcome' not in st.session_state:
         st.session_state.conversation_outcome = None
+    if 'conversation_id' not in st.session_state:
+        st.session_state.conversation_id = None
+    if 'ended_at' not in st.session_state:
+        st.session_state.ended_at = None
     if 'total_tokens' not in st.session_state:
         st.session_state.total_tokens = 0
     if 'config' not in st.session_state:
@@ -93,27 +149,43 @@ def initialize_session_state():
         st.session_state.api_key = ""
 
 
-def start_conversation():
-    """Initialize conversation with sales bot opening message."""
-    sales_system = create_sales_prompt()
-    st.session_state.sales_history = [{"role": "system", "content": sales_system}]
-    
-    # Sales bot opening message
-    sales_opening = """Hi! Thanks for reaching out about our boxing fitness gym. I have a few questions to help us learn more about you:
+def add_message(role: str, content: str):
+    """Append a message to the transcript lists."""
+    st.session_state.message_roles.append(role)
+    st.session_state.message_contents.append(content)
+    st.session_state.message_timestamps.append(datetime.now().isoformat())
 
-1. What's your main fitness goal? (weight loss, stress relief, learn technique, general fitness, etc.)
-2. How often do you currently exercise?
-3. Any concerns about high-intensity training?
 
-Looking forward to getting you started!"""
-    
-    st.session_state.messages.append({
-        "role": "sales",
-        "content": sales_opening,
-        "timestamp": datetime.now()
-    })
+def append_history(role: str, content: str):
+    """Append a turn to the sales history and the assessor's recent window."""
+    message = {"role": role, "content": content}
+    st.session_state.sales_history.append(message)
+    st.session_state.recent_window.append(message)
+
+
+def drop_last_user_turn():
+    """Undo the user message added by send_message."""
+    st.session_state.message_roles.pop()
+    st.session_state.message_contents.pop()
+    st.session_state.message_timestamps.pop()
+    st.session_state.sales_history.pop()
+    st.session_state.recent_window.pop()
+    st.session_state.user_turn_count -= 1
+
+
+def start_conversation():
+    """Initialize conversation with sales bot opening message."""
+    st.session_state.sales_history = [
+        {"role": "system", "content": SALES_SYSTEM_PROMPT},
+        *INITIAL_HISTORY_TEMPLATE
+    ]
+    st.session_state.recent_window.extend(INITIAL_HISTORY_TEMPLATE)
+    # Random suffix keeps ids unique across sessions started in the same second
+    st.session_state.conversation_id = f"human_test_{datetime.now():%Y%m%d_%H%M%S}_{uuid4().hex[:6]}"
+    st.session_state.config.conversation_id = st.session_state.conversation_id
     
-    st.session_state.sales_history.append({"role": "assistant", "content": sales_opening})
+    add_message("sales", SALES_OPENING)
+    st.session_state.sales_turn_count += 1
     st.session_state.conversation_started = True
 
 
@@ -123,197 +195,361 @@ def send_message(user_input: str):
         return
     
     # Add user message
-    st.session_state.messages.append({
-        "role": "user",
-        "content": user_input,
-        "timestamp": datetime.now()
-    })
-    st.session_state.sales_history.append({"role": "user", "content": user_input})
-    
-    # Check if conversation should end
-    should_end, outcome = assess_conversation_status(
-        st.session_state.sales_history,
-        user_input,
-        st.session_state.config
-    )
+    add_message("user", user_input)
+    st.session_state.user_turn_count += 1
+    append_history("user", user_input)
     
-    if should_end and outcome:
-        st.session_state.conversation_ended = True
-        st.session_state.conversation_outcome = outcome
-        # detect_intent()   #remove
+    # Clear-cut agreement/decline needs no LLM call at all, judged against
+    # the sales turn the user is answering
+    last_sales_message = next(
+        (m["content"] for m in reversed(st.session_state.recent_window) if m["role"] == "assistant"),
+        None
+    )
+    quick = quick_classify(user_input, last_sales_message)
+    if quick is not None:
+        end_conversation(quick.outcome.value)
         return
     
     # Check message limit
-    num_exchanges = len([m for m in st.session_state.messages if m["role"] == "user"])
-    if num_exchanges >= st.session_state.config.max_message_exchanges:
-        st.session_state.conversation_ended = True
-        st.session_state.conversation_outcome = "REACHED_MESSAGE_LIMIT"  #update this.
-        # detect_intent()   #remove
+    if st.session_state.user_turn_count >= st.session_state.config.max_message_exchanges:
+        # Last exchange: no sales reply will be shown, only the assessment matters
+        should_end, outcome = assess_conversation_status(
+            st.session_state.recent_window,
+            user_input,
+            st.session_state.config
+        )
+        if should_end and outcome:
+            end_conversation(outcome)
+        else:
+            end_conversation("REACHED_MESSAGE_LIMIT")  #update this.
+        return
+    
+    # The sales reply carries its own conversation status, so one call covers both
+    reply = SalesReplyStream(st.session_state.sales_history, st.session_state.config)
+    
+    reply_slot = st.empty()
+    with reply_slot.container():
+        with st.chat_message("sales", avatar="🥊"):
+            st.write_stream(reply)
+    
+    st.session_state.total_tokens += reply.tokens
+    if reply.error:
+        # Take back the unanswered turn so the history stays user/assistant
+        # pairs; the user can send it again
+        reply_slot.empty()
+        drop_last_user_turn()
+        st.error(f"Error getting response: {reply.error}. Please send your message again.")
         return
     
-    # Get sales bot response
-    try:
-        sales_response, intent, tokens = call_llm(
-            st.session_state.sales_history,
-            st.session_state.config,
-            "sales"
+    should_end, outcome = reply.should_end, reply.outcome
+    if outcome is None:
+        # Model skipped the status - fall back to a separate assessment
+        should_end, outcome = assess_conversation_status(
+            st.session_state.recent_window,
+            user_input,
+            st.session_state.config
         )
-        st.session_state.total_tokens += tokens
-        st.session_state.intent_detection = intent
-        
-        st.session_state.messages.append({
-            "role": "sales",
-            "content": sales_response,
-            "timestamp": datetime.now()
-        })
-        st.session_state.sales_history.append({"role": "assistant", "content": sales_response})
-        
-    except Exception as e:
-        st.error(f"Error getting response: {str(e)}")
+    
+    if reply.intent is not None:
+        # A reply without an intent keeps the last one detected
+        st.session_state.intent_detection = reply.intent
+    
+    add_message("sales", reply.message)
+    st.session_state.sales_turn_count += 1
+    append_history("assistant", reply.message)
+    
+    if should_end and outcome:
+        end_conversation(outcome)
+        return
+    
+    compact_sales_history()
 
 
-# def detect_intent():
-#     """Get intent detection from sales bot."""
-#     try:
-#         intent_request = st.session_state.sales_history + [{
-#             "role": "user",
-#             "content": "Based on our conversation, please provide your INTENT_DETECTION assessment in the required JSON format."
-#         }]
-        
-#         intent_response, tokens = call_llm(
-#             intent_request,
-#             st.session_state.config,
-#             "sales"
-#         )
-#         st.session_state.total_tokens += tokens
-        
-#         intent_detection = extract_intent_detection(intent_response)
-#         st.session_state.intent_detection = intent_detection
-        
-#     except Exception as e:
-#         st.error(f"Error detecting intent: {str(e)}")
+def end_conversation(outcome: str):
+    """Mark the conversation as over and stamp its end time."""
+    st.session_state.conversation_ended = True
+    st.session_state.conversation_outcome = outcome
+    st.session_state.ended_at = datetime.now().isoformat()
+
+
+def compact_sales_history():
+    """
+    Keeps the sales history bounded: system prompt and opening message, an
+    optional "Prior context" summary, then recent exchanges. Once
+    HISTORY_KEEP_TURNS exchanges beyond the verbatim window have accumulated,
+    the older ones are folded into the summary.
+    """
+    history = st.session_state.sales_history
+    prefix = history[:2]  # system prompt + opening message, identical every turn
+    recent = history[3:] if st.session_state.history_summary else history[2:]
+    keep = 2 * HISTORY_KEEP_TURNS
+    
+    if len(recent) < 2 * keep:
+        return
+    
+    summary, tokens = summarize_history(
+        recent[:-keep],
+        st.session_state.history_summary,
+        st.session_state.config
+    )
+    if not summary:
+        return
+    
+    st.session_state.total_tokens += tokens
+    st.session_state.history_summary = summary
+    st.session_state.sales_history = [
+        *prefix,
+        {"role": "system", "content": f"Prior context: {summary}"},
+        *recent[-keep:]
+    ]
 
 
 def create_download_json() -> str:
     """Create JSON export of conversation."""
     conversation_data = {
-        "conversation_id": f"human_test_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
-        "timestamp": datetime.now().isoformat(),
-        "messages": st.session_state.messages,
-        "intent_detection": st.session_state.intent_detection.model_dump() if st.session_state.intent_detection else None,
+        "conversation_id": st.session_state.conversation_id,
+        "timestamp": st.session_state.ended_at,
+        "messages": [
+            {"role": role, "content": content, "timestamp": timestamp}
+            for role, content, timestamp in zip(
+                st.session_state.message_roles,
+                st.session_state.message_contents,
+                st.session_state.message_timestamps
+            )
+        ],
+        "intent_detection": st.session_state.intent_detection.model_dump(mode="json") if st.session_state.intent_detection else None,
         "outcome": st.session_state.conversation_outcome if st.session_state.conversation_outcome else None,
         "total_tokens_used": st.session_state.total_tokens,
-        "conversation_length": len([m for m in st.session_state.messages if m["role"] == "sales"])
+        "conversation_length": st.session_state.sales_turn_count
     }
-    return json.dumps(conversation_data, indent=2, default=str)
+    return orjson.dumps(conversation_data, option=orjson.OPT_INDENT_2).decode()
 
 
-def create_download_pdf(your_intent, notes) -> bytes:
-    """Create PDF export of conversation."""
-    try:
-        from reportlab.lib.pagesizes import letter
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.units import inch
-        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-        from reportlab.lib import colors
-        from io import BytesIO
-        
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.5*inch, bottomMargin=0.5*inch)
-        story = []
-        styles = getSampleStyleSheet()
-        
-        # Title
-        title_style = ParagraphStyle(
+@st.cache_resource
+def _pdf_styles() -> Dict[str, Any]:
+    """ReportLab styles for the PDF export, built once per server process."""
+    styles = getSampleStyleSheet()
+    return {
+        "heading": styles['Heading2'],
+        "title": ParagraphStyle(
             'CustomTitle',
             parent=styles['Heading1'],
             fontSize=24,
             textColor=colors.HexColor('#1e3a8a'),
             spaceAfter=30
+        ),
+        "metadata": ParagraphStyle('Metadata', parent=styles['Normal'], fontSize=10, textColor=colors.grey),
+        "role_sales": ParagraphStyle(
+            'Role',
+            parent=styles['Normal'],
+            fontSize=11,
+            textColor=colors.HexColor('#1e3a8a'),
+            fontName='Helvetica-Bold'
+        ),
+        "role_user": ParagraphStyle(
+            'Role',
+            parent=styles['Normal'],
+            fontSize=11,
+            textColor=colors.HexColor('#059669'),
+            fontName='Helvetica-Bold'
+        ),
+        "content": ParagraphStyle('Content', parent=styles['Normal'], fontSize=10),
+        "outcome": ParagraphStyle('Outcome', parent=styles['Normal'], fontSize=11),
+        "transcript_table": TableStyle([
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 6)
+        ]),
+        "intent_table": TableStyle([
+            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f0f8ff')),
+            ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey)
+        ]),
+    }
+
+
+def create_download_pdf(your_intent, notes) -> bytes:
+    """Create PDF export of conversation."""
+    if not REPORTLAB:
+        st.error("PDF export requires reportlab. Install with: pip install reportlab")
+        return None
+    
+    intent_detection = st.session_state.intent_detection
+    intent_key = None
+    if intent_detection:
+        intent_key = (
+            INTENT_DISPLAY.get(intent_detection.detected_intent, "Unknown"),
+            intent_detection.confidence_level,
+            intent_detection.reasoning,
+            intent_detection.best_time_to_visit
         )
-        story.append(Paragraph("🥊 Gym Sales Bot Conversation", title_style))
-        story.append(Spacer(1, 0.2*inch))
-        
-        # Metadata
-        metadata_style = ParagraphStyle('Metadata', parent=styles['Normal'], fontSize=10, textColor=colors.grey)
-        story.append(Paragraph(f"<b>Date:</b> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", metadata_style))
-        story.append(Paragraph(f"<b>Conversation ID:</b> human_test_{datetime.now().strftime('%Y%m%d_%H%M%S')}", metadata_style))
+    
+    return _build_pdf(
+        st.session_state.conversation_id,
+        st.session_state.ended_at,
+        tuple(zip(st.session_state.message_roles, st.session_state.message_contents)),
+        intent_key,
+        st.session_state.conversation_outcome,
+        your_intent,
+        notes
+    )
+
+
+# Bounded so PDFs for every session and turn don't pile up in server memory
+@st.cache_data(show_spinner=False, max_entries=32, ttl=3600)
+def _build_pdf(
+    conversation_id: str,
+    ended_at: str,
+    messages_key: tuple,
+    intent_key: Optional[tuple],
+    outcome: Optional[str],
+    your_intent: Optional[str],
+    notes: Optional[str]
+) -> bytes:
+    """Render the PDF transcript. Cached on its inputs so reruns reuse the bytes."""
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.5*inch, bottomMargin=0.5*inch)
+    story = []
+    styles = _pdf_styles()
+    
+    # Title
+    story.append(Paragraph("🥊 Gym Sales Bot Conversation", styles["title"]))
+    story.append(Spacer(1, 0.2*inch))
+    
+    # Metadata
+    story.append(Paragraph(f"<b>Date:</b> {ended_at[:19].replace('T', ' ')}", styles["metadata"]))
+    story.append(Paragraph(f"<b>Conversation ID:</b> {conversation_id}", styles["metadata"]))
+    story.append(Spacer(1, 0.3*inch))
+    
+    # Conversation
+    story.append(Paragraph("<b>Conversation Transcript</b>", styles["heading"]))
+    story.append(Spacer(1, 0.2*inch))
+    
+    # One table for the whole transcript instead of a paragraph pair per message
+    transcript_rows = [
+        [
+            Paragraph("Sales Bot:", styles["role_sales"]) if role == "sales" else Paragraph("You:", styles["role_user"]),
+            Paragraph(content, styles["content"])
+        ]
+        for role, content in messages_key
+    ]
+    story.append(Table(
+        transcript_rows,
+        colWidths=[1.2*inch, 5.3*inch],
+        style=styles["transcript_table"],
+        splitInRow=1
+    ))
+    
+    # Intent Detection
+    if intent_key:
+        detected_intent, confidence_level, reasoning, best_time_to_visit = intent_key
         story.append(Spacer(1, 0.3*inch))
+        story.append(Paragraph("<b>Intent Detection Results</b>", styles["heading"]))
+        story.append(Spacer(1, 0.1*inch))
         
-        # Conversation
-        story.append(Paragraph("<b>Conversation Transcript</b>", styles['Heading2']))
-        story.append(Spacer(1, 0.2*inch))
+        intent_data = [
+            ["Detected Intent", detected_intent],
+            ["Confidence", f"{confidence_level:.1%}" if confidence_level is not None else "—"],
+            ["Reasoning", reasoning or ""]
+        ]
         
-        for msg in st.session_state.messages:
-            role_name = "Sales Bot" if msg["role"] == "sales" else "You"
-            role_style = ParagraphStyle(
-                'Role',
-                parent=styles['Normal'],
-                fontSize=11,
-                textColor=colors.HexColor('#1e3a8a') if msg["role"] == "sales" else colors.HexColor('#059669'),
-                fontName='Helvetica-Bold'
-            )
-            content_style = ParagraphStyle('Content', parent=styles['Normal'], fontSize=10, leftIndent=20)
-            
-            story.append(Paragraph(f"{role_name}:", role_style))
-            story.append(Paragraph(msg["content"], content_style))
-            story.append(Spacer(1, 0.15*inch))
-        
-        # Intent Detection
-        if st.session_state.intent_detection:
-            story.append(Spacer(1, 0.3*inch))
-            story.append(Paragraph("<b>Intent Detection Results</b>", styles['Heading2']))
-            story.append(Spacer(1, 0.1*inch))
-            
-            intent_data = [
-                ["Detected Intent", st.session_state.intent_detection.detected_intent.value.replace('_', ' ').title()],
-                ["Confidence", f"{st.session_state.intent_detection.confidence_level:.1%}"],
-                ["Reasoning", st.session_state.intent_detection.reasoning]
-            ]
-            
-            if st.session_state.intent_detection.best_time_to_visit:
-                intent_data.append(["Best Time to Visit", st.session_state.intent_detection.best_time_to_visit])
-            
-            intent_table = Table(intent_data, colWidths=[2*inch, 4*inch])
-            intent_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f0f8ff')),
-                ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, -1), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey)
-            ]))
-            story.append(intent_table)
-        
-        # Outcome
-        if st.session_state.conversation_outcome:
-            story.append(Spacer(1, 0.2*inch))
-            outcome_style = ParagraphStyle('Outcome', parent=styles['Normal'], fontSize=11)
-            outcome_text = st.session_state.conversation_outcome.replace('_', ' ').title()
-            story.append(Paragraph(f"<b>Outcome:</b> {outcome_text}", outcome_style))
-
-        # Actual Intent
-        if your_intent:
-            story.append(Spacer(1, 0.2*inch))
-            your_intent_style = ParagraphStyle('Outcome', parent=styles['Normal'], fontSize=11)
-            your_intent_text = your_intent.replace('_', ' ').title()
-            story.append(Paragraph(f"<b>Your actual intent:</b> {your_intent_text}", your_intent_style))
-        # Actual Intent
-        if notes:
-            story.append(Spacer(1, 0.2*inch))
-            notes_style = ParagraphStyle('Outcome', parent=styles['Normal'], fontSize=11)
-            notes_text = notes.replace('_', ' ').title()
-            story.append(Paragraph(f"<b>Your Notes:</b> {notes_text}", notes_style))
+        if best_time_to_visit:
+            intent_data.append(["Best Time to Visit", best_time_to_visit])
         
+        intent_table = Table(intent_data, colWidths=[2*inch, 4*inch])
+        intent_table.setStyle(styles["intent_table"])
+        story.append(intent_table)
+    
+    # Outcome
+    if outcome:
+        story.append(Spacer(1, 0.2*inch))
+        outcome_text = OUTCOME_DISPLAY.get(outcome) or outcome.replace('_', ' ').title()
+        story.append(Paragraph(f"<b>Outcome:</b> {outcome_text}", styles["outcome"]))
 
-        doc.build(story)
-        buffer.seek(0)
-        return buffer.getvalue()
+    # Actual Intent
+    if your_intent:
+        story.append(Spacer(1, 0.2*inch))
+        your_intent_text = your_intent.replace('_', ' ').title()
+        story.append(Paragraph(f"<b>Your actual intent:</b> {your_intent_text}", styles["outcome"]))
+    # Actual Intent
+    if notes:
+        story.append(Spacer(1, 0.2*inch))
+        notes_text = notes.replace('_', ' ').title()
+        story.append(Paragraph(f"<b>Your Notes:</b> {notes_text}", styles["outcome"]))
+    
+
+    doc.build(story)
+    buffer.seek(0)
+    return buffer.getvalue()
+
+
+def render_message(role: str, content: str):
+    """Render one chat message bubble."""
+    with st.chat_message(role, avatar="🥊" if role == "sales" else "👤"):
+        st.markdown(content)
+
+
+@st.fragment
+def chat_fragment():
+    """Chat transcript and input. Sending a message reruns only this fragment."""
+    # Testing context reminder
+    if not st.session_state.conversation_ended:
+        st.info("💬 **Testing Mode**: Chat naturally as if you're a real prospect. The conversation will end automatically when the bot detects agreement, rejection, or after 10 exchanges.")
+    
+    # Progress indicator and token count - filled in at the end, after any new
+    # message is handled. They live here rather than in the sidebar because a
+    # message only reruns this fragment.
+    progress_slot = st.empty()
+    tokens_slot = st.empty()
+    
+    # Chat display
+    st.markdown("### 💬 Chat")
+    
+    # Display messages - older ones stay collapsed so long chats render quickly
+    roles = st.session_state.message_roles
+    contents = st.session_state.message_contents
+    num_earlier = max(len(roles) - CHAT_WINDOW, 0)
+    if num_earlier:
+        with st.expander(f"Show {num_earlier} earlier messages"):
+            for role, content in zip(roles[:num_earlier], contents[:num_earlier]):
+                render_message(role, content)
+    
+    for role, content in zip(roles[num_earlier:], contents[num_earlier:]):
+        render_message(role, content)
+    
+    # Input area. Inside a fragment the input sits inline rather than pinned
+    # to the page bottom, so new bubbles go in a slot above it.
+    if not st.session_state.conversation_ended:
+        new_messages = st.container()
+        user_input = st.chat_input("Type your message...", key="chat_input")
+        if user_input and user_input.strip():
+            # New bubbles are drawn in place, so the fragment needs no second run;
+            # only a finished conversation changes anything outside the chat
+            with new_messages:
+                render_message("user", user_input)
+                send_message(user_input)
+            if st.session_state.conversation_ended:
+                st.rerun()
         
-    except ImportError:
-        st.error("PDF export requires reportlab. Install with: pip install reportlab")
-        return None
+        num_exchanges = st.session_state.user_turn_count
+        progress = num_exchanges / st.session_state.config.max_message_exchanges
+        progress_slot.progress(progress, text=f"Exchange {num_exchanges}/{st.session_state.config.max_message_exchanges}")
+    else:
+        # Show why conversation ended
+        if st.session_state.conversation_outcome == "agreed_to_free_class":
+            st.success("✅ **Conversation Complete!** The bot detected you agreed to book a free class.")
+        elif st.session_state.conversation_outcome == "not_interested":
+            st.info("❌ **Conversation Complete!** The bot detected you're not interested.")
+        elif st.session_state.conversation_outcome == "REACHED_MESSAGE_LIMIT":
+            st.warning("🕐 **Conversation Complete!** Reached the 10-message exchange limit.")
+        
+        st.markdown("👇 **Scroll down to see the intent detection results and download options.**")
+    
+    if st.session_state.total_tokens > 0:
+        tokens_slot.caption(f"**Tokens Used:** {st.session_state.total_tokens:,}")
 
 
 def reset_conversation():
@@ -390,18 +626,16 @@ def main():
             st.session_state.api_key = api_key
 
             if api_key:
-                initialize_client(api_key)
+                get_client(api_key)
                 st.success("✅ API Key configured")
             else:
                 st.warning("⚠️ Please enter your OpenAI API Key")
+
+        st.session_state.config.api_key = st.session_state.api_key or None
         
         st.divider()
         st.markdown(f"**Max Exchanges:** {st.session_state.config.max_message_exchanges}")
         st.markdown(f"**Model:** {st.session_state.config.sales_model}")
-        
-        if st.session_state.total_tokens > 0:
-            st.divider()
-            st.markdown(f"**Tokens Used:** {st.session_state.total_tokens:,}")
     
     # Main content
     if not st.session_state.conversation_started:
@@ -414,42 +648,11 @@ def main():
                 st.rerun()
     
     else:
-        # Testing context reminder
-        if not st.session_state.conversation_ended:
-            st.info("💬 **Testing Mode**: Chat naturally as if you're a real prospect. The conversation will end automatically when the bot detects agreement, rejection, or after 10 exchanges.")
-        
-        # Progress indicator
-        if not st.session_state.conversation_ended:
-            num_exchanges = len([m for m in st.session_state.messages if m["role"] == "user"])
-            progress = num_exchanges / st.session_state.config.max_message_exchanges
-            st.progress(progress, text=f"Exchange {num_exchanges}/{st.session_state.config.max_message_exchanges}")
-        
-        # Chat display
-        st.markdown("### 💬 Chat")
-        
-        # Display messages
-        for msg in st.session_state.messages:
-            with st.chat_message(msg["role"], avatar="🥊" if msg["role"] == "sales" else "👤"):
-                st.markdown(msg["content"])
-        
-        # Input area
-        if not st.session_state.conversation_ended:
-            user_input = st.chat_input("Type your message...", key="chat_input")
-            if user_input:
-                send_message(user_input)
-                st.rerun()
-        else:
-            # Show why conversation ended
-            if st.session_state.conversation_outcome == "agreed_to_free_class":
-                st.success("✅ **Conversation Complete!** The bot detected you agreed to book a free class.")
-            elif st.session_state.conversation_outcome == "not_interested":
-                st.info("❌ **Conversation Complete!** The bot detected you're not interested.")
-            elif st.session_state.conversation_outcome == "REACHED_MESSAGE_LIMIT":
-                st.warning("🕐 **Conversation Complete!** Reached the 10-message exchange limit.")
-            
-            st.markdown("👇 **Scroll down to see the intent detection results and download options.**")
+        chat_fragment()
         
         # Intent Detection Results
+        actual_intent = ""
+        feedback_notes = ""
         if st.session_state.conversation_ended and st.session_state.intent_detection:
             st.markdown("---")
             st.markdown("### 🎯 Intent Detection Results")
@@ -458,12 +661,13 @@ def main():
             with col1:
                 st.metric(
                     "Detected Intent", 
-                    st.session_state.intent_detection.detected_intent.value.replace('_', ' ').title()
+                    INTENT_DISPLAY.get(st.session_state.intent_detection.detected_intent, "Unknown")
                 )
             with col2:
+                confidence = st.session_state.intent_detection.confidence_level
                 st.metric(
                     "Confidence",
-                    f"{st.session_state.intent_detection.confidence_level:.0%}"
+                    f"{confidence:.0%}" if confidence is not None else "—"
                 )
             with col3:
                 if st.session_state.intent_detection.best_time_to_visit:
@@ -473,11 +677,12 @@ def main():
                     )
             
             with st.expander("📝 Reasoning", expanded=True):
-                st.markdown(st.session_state.intent_detection.reasoning)
+                st.markdown(st.session_state.intent_detection.reasoning or "_No reasoning given._")
             
             # Outcome
             if st.session_state.conversation_outcome:
-                outcome_text = st.session_state.conversation_outcome.replace('_', ' ').title()
+                outcome = st.session_state.conversation_outcome
+                outcome_text = OUTCOME_DISPLAY.get(outcome) or outcome.replace('_', ' ').title()
                 outcome_emoji = "✅" if st.session_state.conversation_outcome == "agreed_to_free_class" else "❌"
                 st.markdown(f"**Outcome:** {outcome_emoji} {outcome_text}")
             
@@ -490,12 +695,12 @@ def main():
             with col1:
                 actual_intent = st.selectbox(
                     "What was YOUR actual intent?",
-                    [""] + [intent.value.replace('_', ' ').title() for intent in Intent],
+                    [""] + list(INTENT_DISPLAY.values()),
                     help="Select what you were really trying to communicate"
                 )
                 
                 if actual_intent:
-                    detected = st.session_state.intent_detection.detected_intent.value.replace('_', ' ').title()
+                    detected = INTENT_DISPLAY.get(st.session_state.intent_detection.detected_intent, "Unknown")
                     if actual_intent == detected:
                         st.success("✅ Bot detected your intent correctly!")
                     else:
@@ -530,7 +735,7 @@ def main():
                 st.download_button(
                     label="📄 Download JSON",
                     data=json_data,
-                    file_name=f"conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                    file_name=f"{st.session_state.conversation_id}.json",
                     mime="application/json",
                     use_container_width=True
                 )
@@ -542,7 +747,7 @@ def main():
                         st.download_button(
                             label="📑 Download PDF",
                             data=pdf_data,
-                            file_name=f"conversation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
+                            file_name=f"{st.session_state.conversation_id}.pdf",
                             mime="application/pdf",
                             use_container_width=True
                         )
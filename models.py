@@ -2,9 +2,9 @@
 Pydantic models for the gym lead qualification chatbot simulator.
 """
 
-from pydantic import BaseModel, Field
-from typing import List, Optional, Literal
-from datetime import datetime
+from copy import copy
+from pydantic import BaseModel, Field, WrapValidator, create_model
+from typing import Annotated, Dict, Optional, Literal
 from enum import Enum
 
 
@@ -17,6 +17,33 @@ class Intent(str, Enum):
     SOCIAL_COMMUNITY = "social_community"
     JUST_FREE_CLASS = "just_wants_free_class"
 
+# Human-readable labels, e.g. Intent.WEIGHT_LOSS -> "Weight Loss"
+INTENT_DISPLAY: Dict[Intent, str] = {i: i.value.replace('_', ' ').title() for i in Intent}
+
+def _streamable(enum_cls):
+    """
+    Validator for enum fields of a streamed reply: a value cut off mid-stream
+    (e.g. "weight_lo") reads as None until the rest arrives. Values that
+    aren't a prefix of any member still fail validation.
+    """
+    values = {e.value for e in enum_cls}
+
+    def validate(value, handler):
+        if isinstance(value, str) and value not in values and any(v.startswith(value) for v in values):
+            return None
+        return handler(value)
+
+    return WrapValidator(validate)
+
+def _streaming(model, **annotations):
+    """
+    Copy of `model` with the given field annotations swapped in, for reading
+    partial replies. Name, defaults and descriptions are kept, so the tool
+    schema sent to the LLM is the same as for `model`.
+    """
+    fields = {name: (annotation, copy(model.model_fields[name])) for name, annotation in annotations.items()}
+    return create_model(model.__name__, __base__=model, __doc__=model.__doc__, **fields)
+
 class IntentDetection(BaseModel):
     """Sales LLM's detected intent output."""
     detected_intent: Optional[Intent] = None
@@ -24,11 +51,6 @@ class IntentDetection(BaseModel):
     reasoning: Optional[str] = None
     best_time_to_visit: Optional[str] = None  # morning/evening/weekend
 
-class salesResponse(BaseModel):
-    """Sales LLM's response structure."""
-    message: str = Field(..., description="The sales agent's message to the prospect.") 
-    intent_detection: Optional[IntentDetection] = Field(..., description="The detected intent from the prospect's response.")
-
 class OutcomeChoices(str, Enum):
     """Possible conversation outcomes."""
     AGREED_FREE_CLASS= "agreed_to_free_class"
@@ -36,12 +58,38 @@ class OutcomeChoices(str, Enum):
     CONTINUE ="continue"
     #REACHED_MESSAGE_LIMIT = "reached_message_limit"  #remove this
 
+# Human-readable labels; str-valued so outcome strings look up directly
+OUTCOME_DISPLAY: Dict[OutcomeChoices, str] = {o: o.value.replace('_', ' ').title() for o in OutcomeChoices}
+
+class salesResponse(BaseModel):
+    """Sales LLM's response structure."""
+    message: str = Field(..., description="The sales agent's message to the prospect.") 
+    intent_detection: Optional[IntentDetection] = Field(..., description="The detected intent from the prospect's response.")
+    outcome: Optional[OutcomeChoices] = Field(None, description="Conversation status after the prospect's latest message.")
+    should_end: bool = Field(False, description="True when the outcome is agreed_to_free_class or not_interested.")
+
 class ConversationOutcome(BaseModel):
     """Result of conversation. and whether or not to proceed"""
     outcome: OutcomeChoices = Field(..., description="The determined outcome of the conversation.")
     reasoning: str = Field(..., description="Explanation for the determined outcome.")
     should_end: bool = Field(..., description="Indicates if the conversation should end.")
 
+# Lenient variants for create_partial/streamed replies only; final replies
+# are validated against the models above
+StreamingIntentDetection = _streaming(
+    IntentDetection,
+    detected_intent=Annotated[Optional[Intent], _streamable(Intent)]
+)
+StreamingSalesResponse = _streaming(
+    salesResponse,
+    intent_detection=Optional[StreamingIntentDetection],
+    outcome=Annotated[Optional[OutcomeChoices], _streamable(OutcomeChoices)]
+)
+StreamingConversationOutcome = _streaming(
+    ConversationOutcome,
+    outcome=Annotated[OutcomeChoices, _streamable(OutcomeChoices)]
+)
+
 class SimulationConfig(BaseModel):
     """Configuration for running simulations."""
     # Model settings
@@ -51,6 +99,13 @@ class SimulationConfig(BaseModel):
     sales_temperature: float = 0.6
     prospect_max_tokens: int = 100
     sales_max_tokens: int = 250
+    assessment_model: str = "openai/gpt-4o-mini"
+    assessment_max_tokens: int = 80
+    assessment_message_chars: int = 300  # per history message shown to the assessor
+    embedding_model: str = "openai/text-embedding-3-small"
+    # Reuse an earlier assessment when the prospect's response embeds at least
+    # this close to one already assessed (e.g. 0.95); None disables the lookup
+    semantic_cache_threshold: Optional[float] = None
     
     # Conversation limits
     max_message_exchanges: int = 3
@@ -60,4 +115,7 @@ class SimulationConfig(BaseModel):
     
     # API settings
     api_provider: Literal["openai", "groq", "together"] = "openai"
-    api_key: Optional[str] = None
\ No newline at end of file
+    api_key: Optional[str] = None
+    conversation_id: Optional[str] = None  # sent as the request `user`
+    requests_per_minute: int = 500
+    tokens_per_minute: int = 200_000
\ No newline at end of file
@@ -2,34 +2,326 @@
 Main simulator for gym lead qualification chatbot testing.
 """
 
-import random
+import asyncio
+import atexit
+import functools
+import hashlib
+import importlib.util
+import re
 import json
+import logging
+import logging.handlers
 import os
-from typing import List, Dict, Any, Tuple, Optional
-from datetime import datetime
-from tqdm import tqdm
-from openai import OpenAI
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, List, Dict, Any, Final, Iterable, Tuple, Optional
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from pydantic import BaseModel, ValidationError
+import diskcache
+import httpx
 import instructor 
+import openai
+from instructor.core.exceptions import InstructorRetryException
+from tenacity import AsyncRetrying, retry_if_exception, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 
-from models import ConversationOutcome, SimulationConfig, salesResponse
+from models import (
+    ConversationOutcome, IntentDetection, OutcomeChoices, SimulationConfig,
+    StreamingConversationOutcome, StreamingSalesResponse, salesResponse
+)
 
+if TYPE_CHECKING:
+    import numpy as np  # imported where used; only the opt-in semantic cache needs it
 
 
-# Initialize OpenAI client
-client = None
 
+# Log records are queued and written by a listener thread, so error bursts
+# never block the event loop on stdout
+logger = logging.getLogger(__name__)
+_log_queue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler(), respect_handler_level=True)
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.propagate = False
+_log_listener.start()
+atexit.register(_log_listener.stop)
 
-def initialize_client(api_key: str):
-    """Initialize the OpenAI client with API key."""
-    global client
-    client = instructor.from_openai(
-        OpenAI(
-            api_key=api_key,
-            base_url="https://openrouter.ai/api/v1",
-            )
-            )
+# Shared event loop for all LLM calls. The async client's connection pool is
+# bound to the loop it first runs on, so every call goes through this one
+# long-lived loop instead of a fresh asyncio.run() per call.
+_loop = None
+_loop_lock = threading.Lock()
 
+# Upper bound on in-flight API requests across all sessions sharing the loop
+MAX_CONCURRENT_REQUESTS = 8
+_request_slots = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
 
+# Transient API errors are retried with jittered exponential backoff
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)
+MAX_ATTEMPTS = 6
+
+# On-disk cache for near-deterministic calls (temperature <= CACHEABLE_TEMPERATURE),
+# so identical assessments are free across reruns and restarts
+LLM_CACHE_DIR = ".llm_cache"
+LLM_CACHE_TTL = 7 * 86400
+CACHEABLE_TEMPERATURE = 0.1
+_llm_cache = None
+
+
+# Connection pool size for each API key's HTTP client. With the optional h2
+# package installed, requests are multiplexed over HTTP/2 connections.
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+# A stalled request fails after a minute and is retried, instead of waiting
+# out openai's 10-minute default
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+HTTP2 = importlib.util.find_spec("h2") is not None
+# Clients for the most recently used API keys, oldest first; each owns an
+# HTTP client that is closed when its key is evicted
+MAX_CLIENTS = 32
+_clients: "OrderedDict[str, Tuple[Any, httpx.AsyncClient]]" = OrderedDict()
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key: str):
+    """
+    Returns the instructor-wrapped client for an API key. Built once per key
+    and reused, so its connection pool survives across calls and reruns.
+    """
+    with _clients_lock:
+        if api_key in _clients:
+            _clients.move_to_end(api_key)
+            return _clients[api_key][0]
+
+        http_client = DefaultAsyncHttpxClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT, http2=HTTP2)
+        client = instructor.from_openai(
+            AsyncOpenAI(
+                api_key=api_key,
+                base_url="https://openrouter.ai/api/v1",
+                http_client=http_client,
+                timeout=HTTP_TIMEOUT,
+                max_retries=0,  # retried by _retrying() instead
+                ),
+            # Replies come back as a tool call carrying message, intent and
+            # conversation status together - one request per turn
+            mode=instructor.Mode.TOOLS
+                )
+        _clients[api_key] = (client, http_client)
+
+        if len(_clients) > MAX_CLIENTS:
+            _, (_, evicted) = _clients.popitem(last=False)
+            if _loop is not None:
+                asyncio.run_coroutine_threadsafe(evicted.aclose(), _loop)
+        return client
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared background event loop, starting it on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-event-loop", daemon=True).start()
+    return _loop
+
+
+def run_sync(coro):
+    """Run a coroutine on the shared event loop and block until it finishes."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+@atexit.register
+def close_clients():
+    """Close pooled connections on the shared loop before the process exits."""
+    with _clients_lock:
+        clients = [http_client for _, http_client in _clients.values()]
+        _clients.clear()
+    if _loop is None or not clients:
+        return
+
+    async def _close():
+        await asyncio.gather(*(c.aclose() for c in clients), return_exceptions=True)
+
+    try:
+        asyncio.run_coroutine_threadsafe(_close(), _loop).result(timeout=5)
+    except Exception:
+        logger.exception("Error closing HTTP clients")
+
+
+def _get_llm_cache() -> diskcache.Cache:
+    """Return the response cache, opening it on first use."""
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = diskcache.Cache(LLM_CACHE_DIR)
+    return _llm_cache
+
+
+def _estimate_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Rough prompt size at ~4 characters per token (plain or content-part messages)."""
+    chars = 0
+    for m in messages:
+        content = m["content"]
+        if isinstance(content, str):
+            chars += len(content)
+        else:
+            chars += sum(len(part.get("text", "")) for part in content)
+    return chars // 4
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute token buckets. acquire() waits
+    until both have room, so bursts are paced under the provider's limits
+    instead of bouncing off 429s. Only used from the shared event loop.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def adjust(self, tokens: int):
+        """Return (or, if negative, charge) token budget once real usage is known."""
+        self._tokens = min(self.tokens_per_minute, self._tokens + tokens)
+
+    async def acquire(self, tokens: int):
+        """Wait for one request slot and `tokens` of token budget."""
+        tokens = min(tokens, self.tokens_per_minute)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep(max(
+                    (1 - self._requests) * 60 / self.requests_per_minute,
+                    (tokens - self._tokens) * 60 / self.tokens_per_minute
+                ))
+
+
+@functools.lru_cache(maxsize=32)
+def _get_rate_limiter(api_key: str, requests_per_minute: int, tokens_per_minute: int) -> RateLimiter:
+    """One limiter per API key and limit pair, shared by every session."""
+    return RateLimiter(requests_per_minute, tokens_per_minute)
+
+
+async def _throttle(config: SimulationConfig, messages: List[Dict[str, Any]], max_tokens: int) -> int:
+    """Wait for rate-limit budget for a request of this size. Returns the estimate."""
+    limiter = _get_rate_limiter(config.api_key, config.requests_per_minute, config.tokens_per_minute)
+    estimate = _estimate_tokens(messages) + max_tokens
+    await limiter.acquire(estimate)
+    return estimate
+
+
+def _reconcile(config: SimulationConfig, estimate: int, actual: int):
+    """Settle the rate limiter's token bucket against a request's reported usage."""
+    limiter = _get_rate_limiter(config.api_key, config.requests_per_minute, config.tokens_per_minute)
+    limiter.adjust(estimate - actual)
+
+
+def _request_tags(config: SimulationConfig) -> Dict[str, str]:
+    """
+    Extra request fields identifying the conversation. Sending its ID as
+    `user` keeps a conversation's turns routed to the same prompt-cache shard.
+    """
+    return {"user": config.conversation_id} if config.conversation_id else {}
+
+
+def _retrying(retry_if=lambda e: True) -> AsyncRetrying:
+    """
+    Retries RETRYABLE_ERRORS (429s, connection drops, timeouts) with jittered
+    exponential backoff, up to MAX_ATTEMPTS; `retry_if` can veto a retry.
+    The last error is re-raised as-is.
+    """
+    return AsyncRetrying(
+        retry=retry_if_exception(lambda e: isinstance(e, RETRYABLE_ERRORS) and retry_if(e)),
+        wait=wait_random_exponential(min=1, max=30),
+        stop=stop_after_attempt(MAX_ATTEMPTS),
+        reraise=True
+    )
+
+
+def _reask_policy() -> AsyncRetrying:
+    """
+    instructor's own retry loop: one re-ask when the response fails
+    validation. API errors are raised straight through to _retrying(), so
+    they get its backoff instead of being retried immediately here.
+    """
+    return AsyncRetrying(
+        retry=retry_if_exception_type((ValidationError, json.JSONDecodeError)),
+        stop=stop_after_attempt(2)
+    )
+
+
+def _cache_key(
+    response_model: type[BaseModel],
+    messages: List[Dict[str, Any]],
+    model: str,
+    temperature: float,
+    max_tokens: int
+) -> str:
+    """Response cache key for a request."""
+    payload = json.dumps(messages, sort_keys=True) + model + str(temperature) + str(max_tokens) + response_model.__name__
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+async def _create_structured(
+    config: SimulationConfig,
+    response_model: type[BaseModel],
+    messages: List[Dict[str, Any]],
+    model: str,
+    temperature: float,
+    max_tokens: int
+) -> Tuple[BaseModel, int]:
+    """
+    Structured completion returning the parsed response and token count.
+    Near-deterministic calls are served from the disk cache when possible
+    (cache hits cost 0 tokens).
+    """
+    cache_key = None
+    if temperature <= CACHEABLE_TEMPERATURE:
+        cache_key = _cache_key(response_model, messages, model, temperature, max_tokens)
+        cached = _get_llm_cache().get(cache_key)
+        if cached is not None:
+            return response_model.model_validate_json(cached), 0
+
+    async for attempt in _retrying():
+        with attempt:
+            estimate = await _throttle(config, messages, max_tokens)
+            async with _request_slots:
+                try:
+                    response = await get_client(config.api_key).chat.completions.create(
+                        model=model,
+                        **_request_tags(config),
+                        messages=messages,
+                        max_tokens=max_tokens,
+                        temperature=temperature,
+                        response_model=response_model,
+                        max_retries=_reask_policy()
+                    )
+                except InstructorRetryException as e:
+                    logger.warning("%s failed validation after %d attempts", response_model.__name__, e.n_attempts)
+                    raise
+    tokens = response._raw_response.usage.total_tokens
+    _reconcile(config, estimate, tokens)
+
+    if cache_key is not None:
+        _get_llm_cache().set(cache_key, response.model_dump_json(), expire=LLM_CACHE_TTL)
+
+    return response, tokens
+
+
+@functools.lru_cache(maxsize=1)
 def create_sales_prompt() -> str:
     """
     Generates the system prompt for the Sales LLM with qualification rules,
@@ -115,13 +407,20 @@ Pay attention to what they emphasize through questions and detail:
 
 If someone says "general fitness" but then asks 3 questions about "meeting people" and "community vibe" → their real intent is social/community.
 
+## CONVERSATION STATUS
+
+Alongside every reply, set "outcome" based on the prospect's latest message:
+- **agreed_to_free_class**: They agree to try a class, OR talk about when/where/how to attend ("Tuesday works", "I can do mornings", "what should I bring?", "that sounds good" after a booking offer). Talking logistics = commitment - don't wait for "yes, book me".
+- **not_interested**: Explicit rejection ("no thanks", "not for me", "maybe later"), backing out, or stalling with no forward movement ("I need to think about it", "just browsing").
+- **continue**: Still asking about the gym/classes, hasn't engaged with booking yet, or needs more info.
+
+Set "should_end" to true for agreed_to_free_class or not_interested, false for continue. When it ends, your reply is the last message they see - a warm wrap-up, not another question.
+
 ## CRITICAL TECHNICAL NOTES
 
 - You respond naturally to each message
-- You DO NOT control when conversations end
 - You DO NOT include JSON in your conversational responses
 - Keep responses 2-3 sentences (occasionally 4 if really needed)
-- The system handles ending detection separately
 
 ## YOUR TONE IN PRACTICE
 
@@ -141,192 +440,621 @@ Remember: You're having a conversation with a real person who filled out a form.
     return prompt
 
 
-def call_llm(
+# Built once so every request sends byte-identical system prompt bytes,
+# which is what provider-side prefix caching keys on
+SALES_SYSTEM_PROMPT: Final[str] = create_sales_prompt()
+
+
+def with_prompt_caching(messages: List[Dict[str, str]], model: str) -> List[Dict[str, Any]]:
+    """
+    Marks cache breakpoints for Anthropic models routed through OpenRouter.
+    The system prompt and the newest message are tagged so each turn reuses the
+    prefix cached by the previous one. OpenAI models cache identical prefixes
+    automatically, so their messages are passed through unchanged.
+    """
+    if not model.startswith("anthropic/"):
+        return messages
+
+    cached = list(messages)
+    for index in {0, len(cached) - 1}:
+        message = cached[index]
+        if isinstance(message["content"], str):
+            cached[index] = {
+                **message,
+                "content": [{
+                    "type": "text",
+                    "text": message["content"],
+                    "cache_control": {"type": "ephemeral"}
+                }]
+            }
+    return cached
+
+
+async def call_llm_async(
     messages: List[Dict[str, str]],
     config: SimulationConfig,
     role: str
-) -> Tuple[str, int]:
+) -> Tuple[str, Optional[IntentDetection], int]:
     """
     Generic function to call the LLM API with proper configuration.
-    Returns the response text and token count.
+    Returns the response text, detected intent and token count. Transient
+    errors are retried with backoff; a rate-limit error that outlasts the
+    retries is raised for the caller to pace. Any other failure returns an
+    "[Error: ...]" message with no intent.
     """
     model = config.prospect_model if role == "prospect" else config.sales_model
     temperature = config.prospect_temperature if role == "prospect" else config.sales_temperature
     max_tokens = config.prospect_max_tokens if role == "prospect" else config.sales_max_tokens
     
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            response_model= salesResponse
+        response, tokens = await _create_structured(
+            config,
+            salesResponse,
+            with_prompt_caching(messages, model),
+            model,
+            temperature,
+            max_tokens
         )
 
-        # content = response.choices[0].message.content
-        raw_response= response._raw_response
-        tokens = raw_response.usage.total_tokens
-        content = response.message
-        intent = response.intent_detection
-        
-        return content, intent, tokens 
-    
+        return response.message, response.intent_detection, tokens
+
+    except openai.RateLimitError:
+        raise
+
     except Exception as e:
-        print(f"Error calling LLM: {e}")
-        return f"[Error: {str(e)}]", 0
-
-
-# def extract_intent_detection(sales_final_message: str) -> Optional[IntentDetection]:
-#     """
-#     Parses the Sales LLM's final message to extract structured IntentDetection.
-#     Handles both clean JSON and markdown-wrapped JSON.
-#     """
-#     try:
-#         # Look for JSON block in the message
-#         if "INTENT_DETECTION:" in sales_final_message:
-#             json_start = sales_final_message.find("{")
-#             json_end = sales_final_message.rfind("}") + 1
-            
-#             if json_start != -1 and json_end > json_start:
-#                 json_str = sales_final_message[json_start:json_end]
-#                 data = json.loads(json_str)
-                
-#                 # Handle case where LLM returns multiple intents separated by comma
-#                 detected_intent_str = data["detected_intent"].strip()
-                
-#                 # If multiple intents, take the first one
-#                 if "," in detected_intent_str:
-#                     detected_intent_str = detected_intent_str.split(",")[0].strip()
-#                     print(f"Warning: Multiple intents detected, using first: {detected_intent_str}")
-                
-#                 return IntentDetection(
-#                     detected_intent=Intent(detected_intent_str),
-#                     confidence_level=float(data["confidence_level"]),
-#                     reasoning=data["reasoning"],
-#                     best_time_to_visit=data.get("best_time_to_visit")
-#                 )
-#     except Exception as e:
-#         print(f"Error extracting intent detection: {e}")
-    
-#     return None
+        logger.exception("Error calling LLM")
+        return f"[Error: {e}]", None, 0
 
 
-def assess_conversation_status(
-    conversation_history: List[Dict[str, str]],
+def call_llm(
+    messages: List[Dict[str, str]],
+    config: SimulationConfig,
+    role: str
+) -> Tuple[str, Optional[IntentDetection], int]:
+    """Blocking wrapper around call_llm_async."""
+    return run_sync(call_llm_async(messages, config, role))
+
+
+async def summarize_history_async(
+    messages: List[Dict[str, str]],
+    previous_summary: Optional[str],
+    config: SimulationConfig
+) -> Tuple[str, int]:
+    """
+    Condenses older sales conversation turns (plus any earlier summary) into a
+    two-sentence note. Returns the summary and token count, or an empty
+    summary if the call fails.
+    """
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    if previous_summary:
+        transcript = f"Earlier summary: {previous_summary}\n{transcript}"
+
+    summary_messages = [
+        {"role": "system", "content": "Summarize prior turns of this gym sales chat in 2 sentences. Keep the prospect's goals, questions, concerns and availability."},
+        {"role": "user", "content": transcript}
+    ]
+
+    try:
+        async for attempt in _retrying():
+            with attempt:
+                estimate = await _throttle(config, summary_messages, 150)
+                async with _request_slots:
+                    # Plain text, so the raw openai client - instructor's retry
+                    # loop would retry API errors again inside _retrying()
+                    response = await get_client(config.api_key).client.chat.completions.create(
+                        model=config.sales_model,
+                        **_request_tags(config),
+                        messages=summary_messages,
+                        max_tokens=150,
+                        temperature=0.3
+                    )
+        _reconcile(config, estimate, response.usage.total_tokens)
+        return response.choices[0].message.content.strip(), response.usage.total_tokens
+
+    except Exception:
+        logger.exception("Error summarizing history")
+        return "", 0
+
+
+def summarize_history(
+    messages: List[Dict[str, str]],
+    previous_summary: Optional[str],
+    config: SimulationConfig
+) -> Tuple[str, int]:
+    """Blocking wrapper around summarize_history_async."""
+    return run_sync(summarize_history_async(messages, previous_summary, config))
+
+
+class _PartialStream:
+    """
+    A structured completion streamed as partial `response_model` objects.
+    Unlike instructor's create_partial this keeps the HTTP response, so
+    close() can drop it early (the server stops generating) and `usage` is
+    read from the final chunk once the stream is exhausted, along with
+    `finish_reason`.
+    """
+
+    def __init__(self, response_model: type[BaseModel]):
+        self.response_model = response_model
+        self.usage = None
+        self.finish_reason: Optional[str] = None
+        self._response = None
+
+    async def open(self, client: AsyncOpenAI, **kwargs):
+        """Send the request; kwargs go to chat.completions.create."""
+        schema = instructor.openai_schema(self.response_model).openai_schema
+        self._response = await client.chat.completions.create(
+            **kwargs,
+            stream=True,
+            stream_options={"include_usage": True},
+            tools=[{"type": "function", "function": schema}],
+            tool_choice={"type": "function", "function": {"name": schema["name"]}}
+        )
+
+    async def _chunks(self):
+        async for chunk in self._response:
+            if chunk.usage is not None:
+                self.usage = chunk.usage
+            if chunk.choices and chunk.choices[0].finish_reason:
+                self.finish_reason = chunk.choices[0].finish_reason
+            yield chunk
+
+    async def partials(self):
+        """Partial objects, one per streamed chunk of the tool-call arguments."""
+        partials = await instructor.Partial[self.response_model].from_streaming_response_async(
+            self._chunks(), mode=instructor.Mode.TOOLS
+        )
+        async for partial in partials:
+            yield partial
+
+    async def close(self):
+        """Release the connection, cancelling the completion if it's still running."""
+        if self._response is not None:
+            await self._response.close()
+
+
+class SalesReplyStream:
+    """
+    Streams a sales reply from the shared event loop.
+    The request starts as soon as the stream is created. Iterate it to get the
+    message text as it arrives; once exhausted, `message`, `intent`, `tokens`
+    and the conversation status (`should_end`, `outcome`) hold the final reply.
+    `intent` and `outcome` stay None if the model left them out or got them
+    wrong; a reply cut off at max_tokens sets `error` instead. `should_end` follows from `outcome`.
+    """
+
+    def __init__(self, messages: List[Dict[str, str]], config: SimulationConfig):
+        self.message = ""
+        self.intent: Optional[IntentDetection] = None
+        self.should_end = False
+        self.outcome: Optional[str] = None
+        self.tokens = 0
+        self.error: Optional[str] = None
+        self._deltas = queue.Queue()
+        asyncio.run_coroutine_threadsafe(self._produce(list(messages), config), _get_loop())
+
+    async def _produce(self, messages: List[Dict[str, str]], config: SimulationConfig):
+        try:
+            partial = None
+            # Only retried while nothing has been shown; a reply can't restart mid-stream
+            async for attempt in _retrying(retry_if=lambda e: not self.message):
+                with attempt:
+                    estimate = await _throttle(config, messages, config.sales_max_tokens)
+                    stream = _PartialStream(StreamingSalesResponse)
+                    async with _request_slots:
+                        try:
+                            await stream.open(
+                                get_client(config.api_key).client,
+                                model=config.sales_model,
+                                **_request_tags(config),
+                                messages=with_prompt_caching(messages, config.sales_model),
+                                max_tokens=config.sales_max_tokens,
+                                temperature=config.sales_temperature
+                            )
+                            async for partial in stream.partials():
+                                text = partial.message or ""
+                                if len(text) > len(self.message) and text.startswith(self.message):
+                                    self._deltas.put(text[len(self.message):])
+                                    self.message = text
+                        finally:
+                            await stream.close()
+
+            # Usage comes in the stream's last chunk; estimate ~4 chars per
+            # token if the provider left it out
+            self.tokens = stream.usage.total_tokens if stream.usage else estimate + len(self.message) // 4
+            _reconcile(config, estimate, self.tokens)
+
+            if stream.finish_reason == "length":
+                raise ValueError("Sales reply was cut off before it was complete")
+            if not self.message:
+                raise ValueError("Sales reply had no message")
+
+            # The stream finished, so the message stands; the intent is only
+            # kept if it holds up to the strict model
+            if partial.intent_detection is not None:
+                try:
+                    intent = IntentDetection.model_validate(partial.intent_detection.model_dump(exclude_unset=True))
+                except ValidationError:
+                    logger.warning("Dropping invalid intent from sales reply")
+                    intent = None
+                if intent is not None and intent.detected_intent is not None:
+                    self.intent = intent
+            if partial.outcome is not None:
+                outcome = OutcomeChoices(partial.outcome)
+                self.outcome = outcome.value
+                # Derived rather than read from the reply, which could disagree
+                self.should_end = outcome != OutcomeChoices.CONTINUE
+
+        except Exception as e:
+            logger.exception("Error streaming LLM response")
+            self.error = str(e)
+
+        finally:
+            self._deltas.put(None)
+
+    def __iter__(self):
+        while (delta := self._deltas.get()) is not None:
+            yield delta
+
+
+# Unambiguous replies, classified without an LLM round-trip.
+# Anything else goes to the assessor.
+AGREE_PATTERN = re.compile(
+    r"\b(sign me up|book me|count me in|let[’']?s do it|where do i sign up)\b",
+    re.IGNORECASE
+)
+DECLINE_PHRASE_PATTERN = re.compile(
+    r"\b(not interested|no thanks|no thank you|i[’']?ll pass|not for me|maybe later|just browsing|leave me alone|unsubscribe)\b",
+    re.IGNORECASE
+)
+# A decline phrase only counts where it closes a clause: "not interested." is
+# a rejection, "not interested in cardio" or "maybe later in the week" isn't
+DECLINE_PATTERN = re.compile(DECLINE_PHRASE_PATTERN.pattern + r"(?=\s*([.!,;]|$))", re.IGNORECASE)
+# Words allowed around a decline phrase ("honestly, it's just not for me")
+# before the message is too long to call without the assessor
+DECLINE_MAX_EXTRA_WORDS = 4
+# Turns that qualify or redirect a decline ("not interested, but what about
+# boxing?") are left to the assessor
+CAVEAT_PATTERN = re.compile(
+    r"\b(but|unless|if|though|although|except|instead)\b|\?",
+    re.IGNORECASE
+)
+
+# Short yeses and day/time answers only mean agreement as a reply to a
+# booking offer ("mornings" is small talk until a class has been suggested),
+# and only without a hedge that could flip them ("sure, but not this week").
+# The offer has to be the question being answered - see _ends_with_booking_offer.
+BOOKING_OFFER_PATTERN = re.compile(
+    r"\b(free class|try (out )?a class|book|schedul\w*|reach out|sign you up)\b",
+    re.IGNORECASE
+)
+ACCEPT_PATTERN = re.compile(
+    r"\b(yes|yeah|yep|sure|sounds (good|great|perfect)|that works|(mon|tues|wednes|thurs|fri|satur|sun)days?|mornings?|evenings?|weekends?)\b",
+    re.IGNORECASE
+)
+HEDGE_PATTERN = re.compile(
+    r"\b(no|not|don[’']?t|can[’']?t|won[’']?t|but|maybe|busy|unless|if)\b|\?",
+    re.IGNORECASE
+)
+
+
+def _ends_with_booking_offer(sales_message: str) -> bool:
+    """
+    True when the message's last sentence is a question offering a class.
+    "The free class is a great intro. Have you boxed before?" isn't - a
+    "yes" there answers the boxing question.
+    """
+    text = re.sub(r"[^\w?.!]+$", "", sales_message)
+    last_sentence = re.split(r"(?<=[.!?])\s+", text)[-1]
+    return last_sentence.endswith("?") and bool(BOOKING_OFFER_PATTERN.search(last_sentence))
+
+
+def _is_plain_decline(prospect_response: str) -> bool:
+    """True when a decline phrase makes up (nearly) the whole response."""
+    if not DECLINE_PATTERN.search(prospect_response) or CAVEAT_PATTERN.search(prospect_response):
+        return False
+    extra_words = re.findall(r"[\w’']+", DECLINE_PATTERN.sub(" ", prospect_response))
+    return len(extra_words) <= DECLINE_MAX_EXTRA_WORDS
+
+
+def quick_classify(prospect_response: str, last_sales_message: Optional[str] = None) -> Optional[ConversationOutcome]:
+    """
+    Keyword pre-filter for explicit agreement or rejection. Returns None when
+    the response is ambiguous and needs the LLM assessment, including when it
+    both declines and agrees. A decline only counts when it is (nearly) the
+    whole response, with no question or "but"; an agreement phrase only
+    counts without a negation, hedge or question around it. Pass the sales message being
+    answered to also catch plain acceptances of a booking offer ("yeah,
+    Tuesday evening works").
+    """
+    agreed = bool(AGREE_PATTERN.search(prospect_response))
+    if agreed and (DECLINE_PHRASE_PATTERN.search(prospect_response) or HEDGE_PATTERN.search(prospect_response)):
+        # "Don't book me yet", "not ready to say count me in", "book me? how much?"
+        return None
+    if _is_plain_decline(prospect_response):
+        return ConversationOutcome(
+            outcome=OutcomeChoices.NOT_INTERESTED,
+            reasoning="Explicit rejection phrase.",
+            should_end=True
+        )
+    if agreed:
+        return ConversationOutcome(
+            outcome=OutcomeChoices.AGREED_FREE_CLASS,
+            reasoning="Explicit agreement phrase.",
+            should_end=True
+        )
+    if (
+        last_sales_message
+        and _ends_with_booking_offer(last_sales_message)
+        and ACCEPT_PATTERN.search(prospect_response)
+        and not HEDGE_PATTERN.search(prospect_response)
+    ):
+        return ConversationOutcome(
+            outcome=OutcomeChoices.AGREED_FREE_CLASS,
+            reasoning="Accepted a booking offer.",
+            should_end=True
+        )
+    return None
+
+
+def _trim(text: str, limit: int) -> str:
+    """Shorten `text` to about `limit` chars, keeping its start and end."""
+    if len(text) <= limit:
+        return text
+    half = limit // 2
+    return f"{text[:half]} ... {text[-half:]}"
+
+
+class SemanticCache:
+    """
+    Assessment outcomes keyed by the embedding of the prospect's response.
+    A lookup hits when a stored response has cosine similarity at or above the
+    threshold, so near-duplicates ("Tuesday evening works" / "tuesday evening
+    works for me") share one LLM assessment. Oldest entries drop off past
+    `max_entries`. Saved to disk at exit and reloaded on first use. Only used
+    from the shared event loop.
+    """
+
+    def __init__(self, max_entries: int = 10_000):
+        self.max_entries = max_entries
+        self._vectors: Optional["np.ndarray"] = None
+        self._outcomes: List[ConversationOutcome] = []
+        self.dirty = False
+
+    def lookup(self, vector: "np.ndarray", threshold: float) -> Optional[ConversationOutcome]:
+        """Most similar stored outcome, if it clears the threshold."""
+        if self._vectors is None:
+            return None
+        scores = self._vectors @ vector
+        best = int(scores.argmax())
+        return self._outcomes[best] if scores[best] >= threshold else None
+
+    def add(self, vector: "np.ndarray", outcome: ConversationOutcome):
+        import numpy as np
+
+        row = vector[np.newaxis, :]
+        self._vectors = row if self._vectors is None else np.vstack([self._vectors, row])[-self.max_entries:]
+        self._outcomes = (self._outcomes + [outcome])[-self.max_entries:]
+        self.dirty = True
+
+    def save(self, path: str):
+        """Write the entries to an .npz file."""
+        import numpy as np
+
+        if self._vectors is None:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, vectors=self._vectors, outcomes=np.array([o.model_dump_json() for o in self._outcomes]))
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path: str) -> "SemanticCache":
+        """Cache with the entries saved at `path`, or an empty one."""
+        import numpy as np
+
+        cache = cls()
+        if os.path.exists(path):
+            with np.load(path) as data:
+                cache._vectors = data["vectors"]
+                cache._outcomes = [ConversationOutcome.model_validate_json(o) for o in data["outcomes"]]
+        return cache
+
+
+# Semantic caches persist next to the response cache, one file per embedding
+# model since vectors from different models aren't comparable
+_semantic_caches: Dict[str, SemanticCache] = {}
+
+
+def _semantic_cache_path(embedding_model: str) -> str:
+    return os.path.join(LLM_CACHE_DIR, f"semantic_{embedding_model.replace('/', '_')}.npz")
+
+
+def _get_semantic_cache(embedding_model: str) -> SemanticCache:
+    """Return the semantic cache for an embedding model, loading it on first use."""
+    if embedding_model not in _semantic_caches:
+        try:
+            _semantic_caches[embedding_model] = SemanticCache.load(_semantic_cache_path(embedding_model))
+        except Exception:
+            logger.exception("Error loading semantic cache")
+            _semantic_caches[embedding_model] = SemanticCache()
+    return _semantic_caches[embedding_model]
+
+
+@atexit.register
+def save_semantic_caches():
+    """Persist semantic caches that gained entries this run."""
+    for embedding_model, cache in list(_semantic_caches.items()):
+        if cache.dirty:
+            try:
+                cache.save(_semantic_cache_path(embedding_model))
+            except Exception:
+                logger.exception("Error saving semantic cache")
+
+
+async def _embed(config: SimulationConfig, text: str) -> Optional["np.ndarray"]:
+    """Unit-length embedding of `text`, or None if the call fails."""
+    import numpy as np
+
+    try:
+        async for attempt in _retrying():
+            with attempt:
+                estimate = await _throttle(config, [{"content": text}], 0)
+                async with _request_slots:
+                    response = await get_client(config.api_key).client.embeddings.create(
+                        model=config.embedding_model,
+                        **_request_tags(config),
+                        input=text
+                    )
+        _reconcile(config, estimate, response.usage.total_tokens)
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    except Exception:
+        logger.exception("Error embedding response")
+        return None
+
+
+# Static assessment rubric. Kept as the system message so the prefix is
+# byte-identical across calls; only the history and response vary per turn.
+_ASSESSMENT_SYSTEM_PROMPT: Final[str] = """Classify the prospect's latest response in this gym sales chat.
+
+agreed_to_free_class - they agree to try a class or talk about attending:
+- "yes", "sounds good", "I'm in", "sign me up", "that works" after a booking offer
+- days/times/availability: "Tuesday works", "I can do mornings", "I'm free weekends"
+- scheduling or logistics: "what times?", "where is it?", "what should I bring?"
+Talking about WHEN, WHERE or HOW to attend counts as agreement - don't wait for "book me".
+
+not_interested - "no thanks", "not for me", "maybe later", "I'll pass", "just browsing",
+backing out, or stalling with no forward movement ("I need to think about it").
+
+continue - still asking about the gym/classes, hasn't engaged with booking, or needs more info.
+
+should_end is true for agreed_to_free_class and not_interested, false for continue.
+Keep reasoning to one short sentence."""
+
+
+async def _stream_outcome(
+    config: SimulationConfig,
+    messages: List[Dict[str, Any]]
+) -> ConversationOutcome:
+    """
+    Streams the assessment and stops reading as soon as the outcome field is
+    complete - should_end follows from it and the reasoning isn't used, so
+    the rest of the completion is skipped. Results share the disk cache with
+    _create_structured.
+    """
+    cache_key = _cache_key(ConversationOutcome, messages, config.assessment_model, 0.0, config.assessment_max_tokens)
+    cached = _get_llm_cache().get(cache_key)
+    if cached is not None:
+        return ConversationOutcome.model_validate_json(cached)
+
+    outcome = None
+    async for attempt in _retrying():
+        with attempt:
+            estimate = await _throttle(config, messages, config.assessment_max_tokens)
+            stream = _PartialStream(StreamingConversationOutcome)
+            async with _request_slots:
+                try:
+                    await stream.open(
+                        get_client(config.api_key).client,
+                        model=config.assessment_model,
+                        **_request_tags(config),
+                        messages=messages,
+                        max_tokens=config.assessment_max_tokens,
+                        temperature=0.0
+                    )
+                    async for partial in stream.partials():
+                        if partial.outcome is not None:
+                            outcome = OutcomeChoices(partial.outcome)
+                            break
+                finally:
+                    # Closing the response, not just the generator, frees the
+                    # connection and stops the rest of the completion
+                    await stream.close()
+
+    # Closed early, so usage rarely arrives; the prompt is most of the cost and
+    # the unread completion budget goes back to the limiter
+    _reconcile(config, estimate, stream.usage.total_tokens if stream.usage else _estimate_tokens(messages))
+
+    if outcome is None:
+        raise ValueError("Assessment ended without an outcome")
+
+    result = ConversationOutcome(
+        outcome=outcome,
+        reasoning="",
+        should_end=outcome != OutcomeChoices.CONTINUE
+    )
+    _get_llm_cache().set(cache_key, result.model_dump_json(), expire=LLM_CACHE_TTL)
+    return result
+
+
+async def assess_conversation_status_async(
+    recent_messages: Iterable[Dict[str, str]],
     prospect_response: str,
     config: SimulationConfig
 ) -> Tuple[bool, Optional[ConversationOutcome]]:
     """
     Uses LLM to assess whether the conversation should end based on the
-    prospect's response. Returns (should_end, outcome).
+    prospect's response. `recent_messages` is the window of turns to show the
+    assessor (e.g. a deque(maxlen=6)); it is used as-is, not sliced.
+    Returns (should_end, outcome).
     """
-    assessment_prompt = f"""You are analyzing a sales conversation. Review the conversation and the prospect's latest response to determine if the conversation should end.
+    last_sales_message = next(
+        (m["content"] for m in reversed(list(recent_messages)) if m["role"] == "assistant"),
+        None
+    )
+    quick = quick_classify(prospect_response, last_sales_message)
+    if quick is not None:
+        return quick.should_end, quick.outcome.value
 
-CONVERSATION HISTORY:
-{json.dumps(conversation_history[-6:], indent=2)}
+    history = "\n".join(
+        f"{m['role']}: {_trim(m['content'], config.assessment_message_chars)}"
+        for m in recent_messages
+    )
+    assessment_prompt = f"""CONVERSATION HISTORY:
+{history}
 
 PROSPECT'S LATEST RESPONSE:
 "{prospect_response}"
+"""
 
-Determine if the prospect has shown INTEREST IN ATTENDING the free class:
-
-SIGNS OF AGREEMENT/INTEREST (mark as "agreed_to_free_class"):
-- Explicit agreement ("yes", "sure", "sounds good", "I'd like to", "let's do it", "I'm in", "sign me up")
-- Discussing specific times or days ("weekend works", "Tuesday evening", "mornings are best", "I can do 6pm")
-- Asking about scheduling ("what times?", "when do classes start?", "what days are available?", "when's the next class?")
-- Expressing time preferences ("I'd prefer evening", "weekend morning would work", "I'm free Tuesday")
-- Providing availability information ("I'm available weekdays", "mornings work for me")
-- Asking logistical questions about attending ("where's it located?", "what should I bring?", "should I wear anything specific?", "do I need to arrive early?")
-- Responding positively to booking offers ("that works", "sounds perfect", "let's try it")
-- Any indication they're planning to attend or moving toward booking
-- Discussing with sales rep about scheduling ("let me check my calendar", "what works for you?")
-
-🚨 CRITICAL RULE: If the prospect is discussing WHEN, WHERE, or HOW to attend → they have AGREED!
-Don't wait for magic words like "yes, book me now". In real sales, talking logistics = commitment.
-
-EXAMPLES THAT ARE AGREEMENT:
-✅ "Tuesday works for me" → AGREED (discussing when)
-✅ "I can do mornings" → AGREED (stating availability)
-✅ "What time is the next class?" → AGREED (asking about scheduling)
-✅ "Should I bring anything?" → AGREED (logistics question)
-✅ "Where's it located?" → AGREED (planning to attend)
-✅ "That sounds good" after booking offer → AGREED (positive response)
-
-SIGNS OF DECLINE (mark as "not_interested"):
-- Explicit rejection ("no thanks", "not interested", "I'll pass", "not for me", "maybe later")
-- Clear backing out after initial interest
-- Strong hesitation with no forward movement ("I need to think about it", "let me get back to you")
-- Saying they're just browsing/looking
-
-OTHERWISE (mark as "continue"):
-- Still asking questions about the gym/classes (not booking-related)
-- Hasn't engaged with booking yet
-- Needs more information before deciding
-- General conversation without commitment signals
-- Sales bot mentioned follow-up/callback but prospect hasn't explicitly declined
-
-⚠️ IMPORTANT: Don't be too conservative! In real sales, discussing scheduling = commitment.
-If they're talking about WHEN/WHERE/HOW to attend, mark as "agreed_to_free_class" immediately.
-Don't require explicit "yes, I want to book" - that's unrealistic!
-
-CRITICAL: Set "should_end" based on outcome:
-- If outcome is "agreed_to_free_class" → should_end = TRUE
-- If outcome is "not_interested" → should_end = TRUE
-- If outcome is "continue" → should_end = FALSE
-
-Return ONLY valid JSON in this exact format:
-{{
-  "should_end": true or false,
-  "outcome": "agreed_to_free_class" or "not_interested" or "continue",
-  "reasoning": "brief explanation of your decision"
-}}"""
 
+    vector = None
+    if config.semantic_cache_threshold is not None:
+        vector = await _embed(config, prospect_response)
+        if vector is not None:
+            cached = _get_semantic_cache(config.embedding_model).lookup(vector, config.semantic_cache_threshold)
+            if cached is not None:
+                return cached.should_end, cached.outcome.value
 
     try:
         # Create assessment messages
         assessment_messages = [
-            {"role": "system", "content": "You are a conversation analyzer. Return only valid JSON."},
+            {"role": "system", "content": _ASSESSMENT_SYSTEM_PROMPT},
             {"role": "user", "content": assessment_prompt}
         ]
         
-        # Call LLM for assessment (use lower temperature for consistency)
-        response = client.chat.completions.create(
-            model=config.sales_model,
-            messages=assessment_messages,
-            max_tokens=150,
-            temperature=0.1,  # Very low for consistent assessment\
-            response_model= ConversationOutcome
-        )
+        # Small model, temperature 0: consistent, cheap, and cacheable
+        response = await _stream_outcome(config, assessment_messages)
         
         should_end = response.should_end
         outcome = response.outcome.value
-        
-        # response_text = response.choices[0].message.content.strip()
-        
-        # # Parse JSON response
-        # # Handle potential markdown code blocks
-        # if "```json" in response_text:
-        #     response_text = response_text.split("```json")[1].split("```")[0].strip()
-        # elif "```" in response_text:
-        #     response_text = response_text.split("```")[1].split("```")[0].strip()
-        
-        # assessment = json.loads(response_text)
-        
-        # should_end = assessment.get("should_end", False)
-        # outcome_str = assessment.get("outcome", "continue")
-        
-        # # Map to ConversationOutcome
-        # outcome = None
-        # if outcome_str == "agreed_to_free_class":
-        #     outcome = ConversationOutcome.AGREED_FREE_CLASS
-        # elif outcome_str == "not_interested":
-        #     outcome = ConversationOutcome.NOT_INTERESTED
+
+        if vector is not None:
+            _get_semantic_cache(config.embedding_model).add(vector, response)
         
         return should_end, outcome
         
-    except Exception as e:
-        print(f"Error in conversation assessment: {e}")
+    except Exception:
+        logger.exception("Error in conversation assessment")
         # Default to continue if assessment fails
         return False, None
 
 
+def assess_conversation_status(
+    recent_messages: Iterable[Dict[str, str]],
+    prospect_response: str,
+    config: SimulationConfig
+) -> Tuple[bool, Optional[ConversationOutcome]]:
+    """Blocking wrapper around assess_conversation_status_async."""
+    return run_sync(assess_conversation_status_async(recent_messages, prospect_response, config))
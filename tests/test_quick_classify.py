@@ -0,0 +1,68 @@
+"""
+Keyword pre-filter checks: clear-cut replies are classified, anything that
+qualifies a decline or mixes signals is left to the LLM assessment.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import OutcomeChoices
+from simulator import quick_classify
+
+BOOKING_OFFER = "Want me to book you into a free class this week?"
+
+
+@pytest.mark.parametrize("response", [
+    "No thanks.",
+    "I'm not interested, thanks",
+    "Honestly, it's just not for me.",
+    "maybe later",
+    "No thank you, I'll pass",
+])
+def test_plain_declines(response):
+    assert quick_classify(response).outcome == OutcomeChoices.NOT_INTERESTED
+
+
+@pytest.mark.parametrize("response", [
+    "I'm not interested in X, but tell me about Y",
+    "maybe later in the week works",
+    "not for me to say",
+    "No thanks needed! Sign me up",
+    "Not interested in cardio. Do you have anything for strength?",
+    "not interested, sign me up for emails instead",
+])
+def test_qualified_declines_go_to_assessor(response):
+    assert quick_classify(response) is None
+
+
+@pytest.mark.parametrize("response", ["Sign me up!", "Count me in"])
+def test_explicit_agreement(response):
+    assert quick_classify(response).outcome == OutcomeChoices.AGREED_FREE_CLASS
+
+
+@pytest.mark.parametrize("response", [
+    "Please don't sign me up for anything",
+    "I'm not ready to say count me in yet",
+    "Don't book me yet, what does it cost?",
+])
+def test_negated_agreement_goes_to_assessor(response):
+    assert quick_classify(response) is None
+
+
+def test_acceptance_needs_booking_offer():
+    assert quick_classify("Tuesday evening works") is None
+    assert quick_classify("Tuesday evening works", BOOKING_OFFER).outcome == OutcomeChoices.AGREED_FREE_CLASS
+    assert quick_classify("Sure, but not this week", BOOKING_OFFER) is None
+
+
+@pytest.mark.parametrize("sales_message, response", [
+    ("Have you boxed before? The free class is a great intro either way.", "yeah a little in college"),
+    ("Have you boxed before? The free class is a great intro either way.", "Yes, I've done a bit"),
+    ("Any questions about the free class? When do you usually train?", "mornings mostly, I run before work"),
+])
+def test_acceptance_must_answer_the_offer(sales_message, response):
+    assert quick_classify(response, sales_message) is None
@@ -28,8 +28,7 @@ def check_dependencies():
         'streamlit': 'streamlit',
         'openai': 'openai',
         'pydantic': 'pydantic',
-        'reportlab': 'reportlab (optional)',
-        'tqdm': 'tqdm'
+        'reportlab': 'reportlab (optional)'
     }
     
     all_ok = True